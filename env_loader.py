@@ -7,4 +7,5 @@ def load_env():
         "JIRA_SERVER": os.getenv("JIRA_SERVER"),
         "JIRA_EMAIL": os.getenv("JIRA_EMAIL"),
         "JIRA_API_TOKEN": os.getenv("JIRA_API_TOKEN"),
+        "OLLAMA_URL": os.getenv("OLLAMA_URL", "http://localhost:11434"),
     }
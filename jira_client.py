@@ -2,13 +2,94 @@ import requests
 from requests.auth import HTTPBasicAuth
 from datetime import datetime
 import logging
+import sys
+import time
+from tracer import NULL_TRACER
+
+# Only the fields the classifier and scheduler actually read are requested from JIRA
+TICKET_FIELDS = ["summary", "description", "labels", "status", "created"]
+
+
+def adf_to_text(node):
+    """Flatten an Atlassian Document Format tree into plain text"""
+    if node is None:
+        return ""
+    if isinstance(node, str):
+        return node
+
+    parts = []
+
+    def walk(current):
+        if current.get("type") == "text":
+            parts.append(current.get("text", ""))
+        elif current.get("type") == "hardBreak":
+            parts.append("\n")
+        for child in current.get("content", []):
+            walk(child)
+        if current.get("type") in ("paragraph", "heading", "listItem", "codeBlock"):
+            parts.append("\n")
+
+    walk(node)
+    return "".join(parts).strip()
+
+
+def parse_jira_timestamp(value):
+    """Convert a JIRA timestamp (e.g. 2024-05-01T10:20:30.000+0000) to epoch seconds"""
+    if not value:
+        return 0.0
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp()
+    except ValueError:
+        return 0.0
+
+
+def is_permanent_error(error):
+    """True for JIRA client errors that will never succeed on retry (4xx except 429)"""
+    response = getattr(error, "response", None)
+    if not isinstance(error, requests.HTTPError) or response is None:
+        return False
+    return 400 <= response.status_code < 500 and response.status_code != 429
+
+
+class Ticket:
+    """Compact JIRA issue record holding only what classification needs"""
+    __slots__ = ("key", "summary", "description", "labels", "status", "created")
+
+    def __init__(self, key, summary, description, labels, status="", created=0.0):
+        self.key = key
+        self.summary = summary
+        self.description = description
+        self.labels = labels
+        # Status category key: "new", "indeterminate" or "done"
+        self.status = status
+        # Creation time as epoch seconds
+        self.created = created
+
+    @classmethod
+    def from_issue(cls, issue):
+        fields = issue["fields"]
+        status = (fields.get("status") or {}).get("statusCategory", {}).get("key", "")
+        return cls(
+            sys.intern(issue["key"]),
+            fields.get("summary") or "",
+            adf_to_text(fields.get("description")),
+            tuple(sys.intern(label) for label in fields.get("labels") or ()),
+            sys.intern(status),
+            parse_jira_timestamp(fields.get("created"))
+        )
+
+    def __repr__(self):
+        return f"Ticket({self.key!r}, labels={list(self.labels)!r})"
+
 
 class JiraClient:
-    def __init__(self, server, email, token, project_key=None):
+    def __init__(self, server, email, token, project_key=None, tracer=None):
         self.server = server
         self.email = email
         self.token = token
         self.project_key = project_key
+        self.tracer = tracer or NULL_TRACER
+        self.max_retries = 5
         # Use Basic Auth with email + API token (works!)
         self.auth = HTTPBasicAuth(email, token)
         self.headers = {
@@ -16,11 +97,11 @@ class JiraClient:
             "Content-Type": "application/json"
         }
         
-    def test_connection(self):
+    def test_connection(self, timeout=5):
         try:
-            # Use a reliable endpoint to verify connectivity
-            url = f"{self.server}/rest/api/3/permissions"
-            response = requests.get(url, headers=self.headers, auth=self.auth, timeout=10)
+            # /myself is the cheapest authenticated endpoint: it checks both reachability and credentials
+            url = f"{self.server}/rest/api/3/myself"
+            response = requests.get(url, headers=self.headers, auth=self.auth, timeout=timeout)
             
             if response.status_code == 200:
                 return True
@@ -32,34 +113,70 @@ class JiraClient:
             logging.error(f"Error connecting to JIRA: {e}")
             return False
 
-    def get_all_tickets(self):
+    def _scope_jql(self, projects=None):
+        if self.project_key:
+            return f'project = "{self.project_key}"'
+        elif projects is not None:
+            project_list = ", ".join(f'"{key}"' for key in projects)
+            return f"project in ({project_list}) order by created DESC"
+        return "order by created DESC"
+
+    def _search_pages(self, jql, fields, max_results=50, timeout=30, validate_query=None):
+        """Yield the raw issues of each search result page"""
         start_at = 0
-        max_results = 50
-        all_issues = []
+        url = f"{self.server}/rest/api/3/search"
         
         while True:
-            jql = f'project = "{self.project_key}"' if self.project_key else "order by created DESC"
             params = {
                 "jql": jql, 
-                "fields": ["summary", "description", "labels", "issuetype", "status", "created"],
+                "fields": fields,
                 "maxResults": max_results,
                 "startAt": start_at
             }
+            if validate_query:
+                params["validateQuery"] = validate_query
             
-            url = f"{self.server}/rest/api/3/search"
-            response = requests.get(url, params=params, headers=self.headers, auth=self.auth)
-            response.raise_for_status()
+            with self.tracer.span("jira.fetch_page", start_at=start_at):
+                response = requests.get(url, params=params, headers=self.headers, auth=self.auth,
+                                        timeout=timeout)
+                response.raise_for_status()
+                issues = response.json()["issues"]
             
-            data = response.json()
-            issues = data["issues"]
-            all_issues.extend(issues)
+            yield issues
             
             if len(issues) < max_results:
                 break
                 
             start_at += max_results
-            
-        return all_issues
+
+    def iter_tickets(self, projects=None):
+        """Yield every ticket page by page, so callers can start on the first page right away"""
+        for issues in self._search_pages(self._scope_jql(projects), TICKET_FIELDS):
+            # Parse at ingest time so the raw JSON page can be released immediately
+            for issue in issues:
+                yield Ticket.from_issue(issue)
+
+    def get_all_tickets(self, projects=None):
+        """Fetch every ticket, optionally restricted to a list of project keys"""
+        return list(self.iter_tickets(projects))
+
+    def get_all_keys(self, projects=None):
+        """Fetch only the issue keys, a fraction of the payload of full tickets"""
+        keys = []
+        for issues in self._search_pages(self._scope_jql(projects), ["key"], max_results=100):
+            keys.extend(sys.intern(issue["key"]) for issue in issues)
+        return keys
+
+    def iter_tickets_by_keys(self, keys, batch_size=50):
+        """Yield full tickets for the given issue keys, in batches of `key in (...)` queries"""
+        for i in range(0, len(keys), batch_size):
+            jql = f"key in ({', '.join(keys[i:i + batch_size])}) order by created DESC"
+            # Keys deleted since they were listed would make a strict query fail with 400;
+            # "warn" lets JIRA skip them and return the rest of the batch
+            for issues in self._search_pages(jql, TICKET_FIELDS, max_results=batch_size,
+                                             validate_query="warn"):
+                for issue in issues:
+                    yield Ticket.from_issue(issue)
 
     def get_tickets_updated_today(self):
         today = datetime.now().strftime("%Y-%m-%d")
@@ -72,13 +189,13 @@ class JiraClient:
             
         params = {
             "jql": jql,
-            "fields": ["summary", "description", "labels"],
+            "fields": TICKET_FIELDS,
             "maxResults": 100
         }
         url = f"{self.server}/rest/api/3/search"
         response = requests.get(url, params=params, headers=self.headers, auth=self.auth)
         response.raise_for_status()
-        return response.json()["issues"]
+        return [Ticket.from_issue(issue) for issue in response.json()["issues"]]
 
     def assign_labels(self, issue_key, labels):
         url = f"{self.server}/rest/api/3/issue/{issue_key}"
@@ -87,8 +204,15 @@ class JiraClient:
                 "labels": [{"add": label} for label in labels]
             }
         }
-        response = requests.put(url, json=data, headers=self.headers, auth=self.auth)
-        response.raise_for_status()
+        with self.tracer.span("jira.put_labels", key=issue_key):
+            for attempt in range(self.max_retries + 1):
+                response = requests.put(url, json=data, headers=self.headers, auth=self.auth)
+                # Back off when JIRA rate-limits concurrent writers
+                if response.status_code not in (429, 503) or attempt == self.max_retries:
+                    break
+                retry_after = response.headers.get("Retry-After")
+                time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+            response.raise_for_status()
         
     def create_ticket(self, summary, description, issue_type="Task"):
         if not self.project_key:
@@ -174,12 +298,12 @@ class JiraClient:
         response.raise_for_status()
         return True
         
-    def get_project_info(self):
+    def get_project_info(self, timeout=None):
         """Get project information by key"""
         if not self.project_key:
             return None
             
         url = f"{self.server}/rest/api/3/project/{self.project_key}"
-        response = requests.get(url, headers=self.headers, auth=self.auth)
+        response = requests.get(url, headers=self.headers, auth=self.auth, timeout=timeout)
         response.raise_for_status()
         return response.json()
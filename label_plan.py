@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import json
+
+
+class PlanWriter:
+    """Streams label decisions to a JSONL plan file, one `{"key", "add"}` entry per ticket"""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, key, labels):
+        self.file.write(json.dumps({"key": key, "add": list(labels)}, separators=(",", ":")) + "\n")
+        # Flush per entry so an interrupted plan run keeps everything decided so far
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_plan(path):
+    """Stream the (key, labels) pairs of a plan file
+
+    A key only repeats when a plan run was interrupted between writing an entry and
+    journaling it; re-adding the same labels is a no-op in JIRA, so no dedup is needed.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written last line from an interrupted plan run
+                continue
+            if entry.get("add"):
+                yield entry["key"], entry["add"]
+
+
+def apply_plan(jira, entries, concurrency=8):
+    """Push label diffs to JIRA in parallel, yielding (key, labels, error) as writes finish
+
+    Entries are consumed lazily and only a small window of writes is in flight at a
+    time, so an interrupted apply stops after the current writes instead of the whole plan.
+    """
+    entries = iter(entries)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            for key, labels in entries:
+                in_flight[executor.submit(jira.assign_labels, key, labels)] = (key, labels)
+                if len(in_flight) >= concurrency * 2:
+                    break
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, labels = in_flight.pop(future)
+                yield key, labels, future.exception()
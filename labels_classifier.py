@@ -1,98 +1,235 @@
 import requests
 import json
 import logging
+import math
+import time
+from collections import Counter
+from tracer import NULL_TRACER
+
+# Single source of truth for the label taxonomy: drives the prompt, the
+# JSON schema sent to Ollama and the validation of the model's answer.
+# Keys are applied verbatim as JIRA labels, so they must not contain spaces.
+LABEL_TAXONOMY = {
+    "maintenance": "Maintenance tasks, minor fixes, code cleanup",
+    "support": "Technical support tickets, user help, questions",
+    "initiative": "New features, projects, business initiatives",
+    "optimization": "Performance improvements, optimizations, refactoring",
+    "documentation": "Creating or updating documentation",
+}
+
+MAX_LABELS = 2
+
+
+def build_label_schema(labels, max_labels=MAX_LABELS):
+    """JSON schema for Ollama's structured output: only known labels can be generated"""
+    return {
+        "type": "object",
+        "properties": {
+            "labels": {
+                "type": "array",
+                "items": {"type": "string", "enum": list(labels)},
+                "minItems": 1,
+                "maxItems": max_labels,
+                "uniqueItems": True
+            }
+        },
+        "required": ["labels"]
+    }
+
+
+def normalize_model_name(name):
+    """Ollama lists untagged models under the `latest` tag"""
+    return name if ":" in name else f"{name}:latest"
+
 
 class TicketClassifier:
-    def __init__(self, model_name="gemma3:latest"):
+    def __init__(self, model_name="gemma3:latest", taxonomy=LABEL_TAXONOMY, tracer=None,
+                 ollama_host="http://localhost:11434", cascade_model=None,
+                 cascade_samples=3, cascade_threshold=0.66):
         self.model_name = model_name
-        self.ollama_url = "http://localhost:11434/api/generate"
-        self.valid_labels = [
-            "initiative", "maintenance", "cost optimization"
-        ]
-        
-    def test_connection(self):
+        self.tracer = tracer or NULL_TRACER
+        self.ollama_host = ollama_host.rstrip("/")
+        self.ollama_url = f"{self.ollama_host}/api/generate"
+        self.taxonomy = taxonomy
+        self.valid_labels = list(taxonomy)
+        self.label_schema = build_label_schema(self.valid_labels)
+
+        # Optional small model answering first; low-confidence answers escalate to model_name
+        self.cascade_model = cascade_model
+        self.cascade_samples = cascade_samples
+        self.cascade_threshold = cascade_threshold
+        self.tier_stats = {}
+
+    def test_connection(self, timeout=3):
+        """Check that Ollama is up and has every configured model, without running a generation"""
         try:
-            response = requests.post(self.ollama_url, json={
-                "model": self.model_name,
-                "prompt": "Test",
-                "stream": False
-            }, timeout=60)
-            return response.status_code == 200
+            response = requests.get(f"{self.ollama_host}/api/tags", timeout=timeout)
+            response.raise_for_status()
         except Exception as e:
             logging.error(f"Error connecting to Ollama: {e}")
             return False
 
-    def classify(self, summary, description):
-        if not self.test_connection():
-            print("❌ Error: Cannot connect to Ollama")
-            return []
-            
-        prompt = f"""
-You are an expert in classifying JIRA tickets. Analyze the ticket title and description and classify it into exactly ONE of the following categories:
+        installed = {model["name"] for model in response.json().get("models", [])}
+        missing = [
+            model for model in (self.cascade_model, self.model_name)
+            if model and normalize_model_name(model) not in installed
+        ]
+        if missing:
+            logging.error(f"Ollama models not installed: {missing} (run `ollama pull <model>`)")
+            return False
+        return True
+
+    def preload(self, keep_alive="30m", timeout=120):
+        """Load the configured models into memory so the first ticket skips the cold start"""
+        for model in (self.cascade_model, self.model_name):
+            if not model:
+                continue
+            try:
+                # A generate request without a prompt only loads the model
+                response = requests.post(self.ollama_url, json={
+                    "model": model,
+                    "keep_alive": keep_alive
+                }, timeout=timeout)
+                response.raise_for_status()
+            except Exception as e:
+                logging.warning(f"Could not preload Ollama model {model}: {e}")
+
+    def build_prompt(self, summary, description):
+        categories = "\n".join(
+            f'- "{label}": {meaning}' for label, meaning in self.taxonomy.items()
+        )
+        return f"""
+You are an expert in classifying JIRA tickets. Analyze the ticket title and description and classify it into the following categories:
 
 AVAILABLE CATEGORIES:
-- "maintenance": Maintenance tasks, minor fixes, code cleanup
-- "support": Technical support tickets, user help, questions
-- "initiative": New features, projects, business initiatives
-- "optimization": Performance improvements, optimizations, refactoring
-- "documentation": Creating or updating documentation
+{categories}
 
 TICKET TO CLASSIFY:
 Title: {summary}
 Description: {description or "No description provided"}
 
 INSTRUCTIONS:
-1. Select up to 2 most relevant categories
-2. Respond ONLY with a valid JSON array
+1. Select up to {MAX_LABELS} most relevant categories
+2. Respond ONLY with a JSON object containing a "labels" array
 3. Use exactly the category names listed above
 
 REQUIRED RESPONSE FORMAT:
-["category1", "category2"]
+{{"labels": ["category1", "category2"]}}
 
 EXAMPLES:
-- Title: "Login not working" → ["maintenance", "support"]
-- Title: "Implement new dashboard" → ["initiative"]
-- Title: "Update API documentation" → ["documentation"]
-- Title: "Optimize database queries" → ["optimization"]
+- Title: "Login not working" → {{"labels": ["maintenance", "support"]}}
+- Title: "Implement new dashboard" → {{"labels": ["initiative"]}}
+- Title: "Update API documentation" → {{"labels": ["documentation"]}}
+- Title: "Optimize database queries" → {{"labels": ["optimization"]}}
 """
 
-        try:
+    def parse_labels(self, text):
+        """Extract the valid labels from a structured response"""
+        labels = json.loads(text)["labels"]
+
+        # The schema already constrains generation; this guards against
+        # servers that ignore the "format" field
+        valid_labels = []
+        for label in labels:
+            if label in self.valid_labels and label not in valid_labels:
+                valid_labels.append(label)
+        return valid_labels[:MAX_LABELS]
+
+    def _generate(self, model, prompt, temperature=0, seed=None):
+        """Run one constrained generation and return the valid labels (may be empty)"""
+        options = {"temperature": temperature}
+        if seed is not None:
+            options["seed"] = seed
+
+        with self.tracer.span("llm.request", model=model) as span:
             response = requests.post(self.ollama_url, json={
-                "model": self.model_name,
+                "model": model,
                 "prompt": prompt,
-                "stream": False
+                "format": self.label_schema,
+                "stream": False,
+                "options": options
             }, timeout=60)
             response.raise_for_status()
-            
-            text = response.json()["response"].strip()
-            
-            # Clean up the response
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].strip()
-            
-            # Look for JSON array in the response
-            if "[" in text and "]" in text:
-                start = text.find("[")
-                end = text.rfind("]") + 1
-                text = text[start:end]
-            
-            # Safely parse JSON
-            labels = json.loads(text)
-            
-            # Validate the labels are in the accepted list
-            valid_labels = [label for label in labels if label in self.valid_labels]
-            
-            if valid_labels:
-                return valid_labels[:2]  # Return a maximum of 2 labels
-            else:
-                print(f"⚠️ Invalid labels in response: {labels}")
+            result = response.json()
+
+            if self.tracer.enabled:
+                # Ollama reports its own phase timings in nanoseconds; load + prompt
+                # evaluation is the server-side time to first token
+                load_ns = result.get("load_duration", 0)
+                prompt_ns = result.get("prompt_eval_duration", 0)
+                span["ttft_ms"] = (load_ns + prompt_ns) / 1e6
+                span["load_ms"] = load_ns / 1e6
+                span["eval_ms"] = result.get("eval_duration", 0) / 1e6
+                span["prompt_tokens"] = result.get("prompt_eval_count", 0)
+                span["output_tokens"] = result.get("eval_count", 0)
+
+        with self.tracer.span("response.parse"):
+            text = result["response"].strip()
+            try:
+                return self.parse_labels(text)
+            except (json.JSONDecodeError, KeyError, TypeError):
+                print(f"⚠️ Error parsing JSON: {text}")
                 return []
-                
-        except json.JSONDecodeError as e:
-            print(f"⚠️ Error parsing JSON: {text}")
-            return []
+
+    def _record_tier(self, tier, seconds, accepted):
+        stats = self.tier_stats.setdefault(tier, {"tickets": 0, "accepted": 0, "seconds": 0.0})
+        stats["tickets"] += 1
+        stats["accepted"] += int(accepted)
+        stats["seconds"] += seconds
+
+    def _classify_small(self, prompt):
+        """Sample the small model and measure self-consistency
+
+        Returns the majority answer when enough samples agree, otherwise [].
+        Sampling stops as soon as the outcome is decided.
+        """
+        # Number of samples that must agree for the small model's answer to be trusted
+        needed = max(1, math.ceil(self.cascade_threshold * self.cascade_samples - 1e-9))
+        votes = Counter()
+
+        for sample in range(self.cascade_samples):
+            # First sample is greedy, the rest explore with a fixed seed per sample
+            labels = self._generate(self.cascade_model, prompt,
+                                    temperature=0 if sample == 0 else 0.7, seed=sample)
+            if labels:
+                votes[tuple(sorted(labels))] += 1
+
+            best, count = votes.most_common(1)[0] if votes else ((), 0)
+            remaining = self.cascade_samples - sample - 1
+            if best and count >= needed:
+                return list(best)
+            if count + remaining < needed:
+                break
+
+        return []
+
+    def classify(self, summary, description):
+        with self.tracer.span("prompt.build"):
+            prompt = self.build_prompt(summary, description)
+
+        try:
+            if self.cascade_model:
+                started = time.perf_counter()
+                try:
+                    labels = self._classify_small(prompt)
+                except Exception as e:
+                    logging.warning(f"Cascade model {self.cascade_model} failed, escalating: {e}")
+                    labels = []
+                self._record_tier(self.cascade_model, time.perf_counter() - started, bool(labels))
+                if labels:
+                    return labels
+
+            started = time.perf_counter()
+            labels = []
+            try:
+                labels = self._generate(self.model_name, prompt)
+            finally:
+                self._record_tier(self.model_name, time.perf_counter() - started, bool(labels))
+
+            if not labels:
+                print("⚠️ Invalid labels in response")
+            return labels
+
         except Exception as e:
             print(f"❌ Error classifying ticket: {e}")
             return []
@@ -1,13 +1,43 @@
 from env_loader import load_env
-from jira_client import JiraClient
+from jira_client import JiraClient, is_permanent_error
 from labels_classifier import TicketClassifier
+from run_journal import (
+    RunJournal, PendingWritesError, CLASSIFIED, APPLIED, UNCHANGED, FAILED, PLANNED, WRITE_FAILED
+)
+from label_plan import PlanWriter, read_plan, apply_plan
+from tracer import Tracer, NULL_TRACER
+from scheduler import TimeBudget, parse_duration, prioritize
+from sharding import (
+    SHARD_BY_KEY, SHARD_BY_PROJECT, parse_shard, shard_of, in_shard, shard_suffix, with_suffix,
+    write_summary, merge_summaries, find_summaries
+)
+from concurrent.futures import ThreadPoolExecutor
+import os
 import sys
+import threading
+import time
 import logging
 
-def main():
+JOURNAL_FILES = {
+    "run": "run_journal.jsonl",
+    "plan": "plan_journal.jsonl"
+}
+SUMMARY_FILE = "run_summary.json"
+PLAN_FILE = "label_plan.jsonl"
+TRACE_FILE = "trace.json"
+WRITE_CONCURRENCY = 8
+
+def main(command="run", plan_file=PLAN_FILE, resume=False, trace_file=None, shard=None,
+         shard_by=SHARD_BY_KEY, time_budget=None, cascade=None):
     print("🤖 JIRA AI Classifier - Automatic Labeling System")
     print("=" * 60)
     
+    # In plan mode decisions go to the plan file and JIRA is only written by `apply`
+    apply_labels = command == "run"
+    
+    # The budget covers the whole maintenance window, including startup and fetching
+    budget = TimeBudget(time_budget) if time_budget is not None else None
+    
     # Configure logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
@@ -19,122 +49,383 @@ def main():
         print(f"❌ Error loading configuration: {e}")
         sys.exit(1)
     
+    tracer = Tracer(trace_file) if trace_file else NULL_TRACER
+    
     # Initialize clients
     jira = JiraClient(
         env["JIRA_SERVER"], 
         env["JIRA_EMAIL"], 
         env["JIRA_API_TOKEN"],
-        env.get("JIRA_PROJECT_KEY")
+        env.get("JIRA_PROJECT_KEY"),
+        tracer=tracer
+    )
+    classifier = TicketClassifier(
+        model_name="gemma3:latest",
+        tracer=tracer,
+        ollama_host=env["OLLAMA_URL"],
+        **(cascade or {})
     )
-    classifier = TicketClassifier(model_name="gemma3:latest")
+    if classifier.cascade_model:
+        print(f"🪜 Model cascade: {classifier.cascade_model} "
+              f"({classifier.cascade_samples} samples, {classifier.cascade_threshold:.0%} agreement) "
+              f"→ {classifier.model_name}")
     
-    # Test connections
+    # Each shard keeps its own journal and summary so processes never share files
+    journal_file = JOURNAL_FILES[command]
+    summary_file = SUMMARY_FILE
+    if shard:
+        shard_index, shard_count = shard
+        suffix = shard_suffix(shard_index, shard_count)
+        journal_file = with_suffix(journal_file, suffix)
+        summary_file = with_suffix(SUMMARY_FILE, suffix)
+        plan_file = with_suffix(plan_file, suffix)
+        print(f"🧩 Shard {shard_index}/{shard_count} (partitioned by {shard_by})")
+    
+    # Test connections concurrently against cheap endpoints
     print("\n🔍 Testing connections...")
     
-    if not jira.test_connection():
-        print("❌ Error: Unable to connect to JIRA")
-        print("Check your credentials in the .env file")
-        sys.exit(1)
-    print("✅ JIRA: Connection successful")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        jira_check = executor.submit(jira.test_connection)
+        ollama_check = executor.submit(classifier.test_connection)
+        project_check = executor.submit(jira.get_project_info, timeout=5) if jira.project_key else None
+        
+        if not jira_check.result():
+            print("❌ Error: Unable to connect to JIRA")
+            print("Check your credentials in the .env file")
+            sys.exit(1)
+        print("✅ JIRA: Connection successful")
+        
+        if not ollama_check.result():
+            print("❌ Error: Unable to connect to Ollama or model not installed")
+            print("Make sure Ollama is running: `ollama serve`")
+            print(f"And that you have the model: `ollama pull {classifier.model_name}`")
+            sys.exit(1)
+        print("✅ Ollama: Connection successful")
+        
+        # Load the model while tickets are fetched; a daemon thread never delays exit
+        threading.Thread(target=classifier.preload, daemon=True).start()
+        
+        # Show project info
+        if project_check:
+            try:
+                project_info = project_check.result()
+                print(f"📋 Project: {project_info['name']} ({project_info['key']})")
+            except Exception as e:
+                print(f"⚠️ Could not retrieve project info: {e}")
     
-    if not classifier.test_connection():
-        print("❌ Error: Unable to connect to Ollama")
-        print("Make sure Ollama is running: `ollama serve`")
-        print("And that you have the Gemma model: `ollama pull gemma:8b`")
+    try:
+        journal = RunJournal(journal_file, resume=resume)
+    except PendingWritesError as e:
+        print(f"❌ {e}")
         sys.exit(1)
-    print("✅ Ollama: Connection successful")
     
-    # Show project info
-    if jira.project_key:
-        try:
-            project_info = jira.get_project_info()
-            print(f"📋 Project: {project_info['name']} ({project_info['key']})")
-        except Exception as e:
-            print(f"⚠️ Could not retrieve project info: {e}")
+    # Replay label writes that were decided but not confirmed before the previous run stopped
+    if resume:
+        print(f"\n♻️ Resuming from {journal_file}: {len(journal.finished)} tickets already finished")
+        for key, labels in list(journal.pending_writes.items()):
+            try:
+                write_labels(jira, journal, key, labels)
+                print(f"✅ {key}: replayed pending labels {labels}")
+            except Exception as e:
+                print(f"❌ {key}: could not replay pending labels: {e}")
+        journal.sync()
     
-    # Fetch all tickets
+    # Fetch all tickets; pages are streamed so classification starts with the first one
     print("\n📚 Fetching ALL tickets from all projects...")
-    tickets = jira.get_all_tickets()
-    apply_labels = True
+    if shard and shard_by == SHARD_BY_PROJECT and not jira.project_key:
+        # Only fetch the projects owned by this shard
+        projects = [p["key"] for p in jira.get_all_projects() if shard_of(p["key"], shard_count) == shard_index]
+        print(f"📂 Projects in this shard: {projects}")
+        tickets = jira.iter_tickets(projects) if projects else iter(())
+    elif shard:
+        # List keys only, then download full tickets just for this shard's slice
+        keys = [key for key in jira.get_all_keys() if in_shard(key, shard_index, shard_count, shard_by)]
+        tickets = jira.iter_tickets_by_keys(keys)
+    else:
+        tickets = jira.iter_tickets()
     
-    if not tickets:
-        print("📭 No tickets found to process")
-        return
+    if resume:
+        tickets = (ticket for ticket in tickets if not journal.is_done(ticket.key))
     
-    print(f"🎟️ Tickets retrieved: {len(tickets)}")
+    # Prioritizing needs the whole ticket set up front; otherwise the total is unknown
+    total = None
+    if budget:
+        tickets = prioritize(tickets)
+        total = len(tickets)
+        print(f"🎟️ Tickets retrieved: {total}")
+        print(f"⏳ Time budget: {budget.seconds:.0f}s - unlabeled, then open, then newest tickets first")
     
     # Stats
     classified = 0
     errors = 0
     labels_applied = 0
+    labels_planned = 0
+    label_counts = {}
+    left_over = []
+    processed = 0
+    started = time.perf_counter()
     
-    print(f"\n🚀 Starting {'classification and labeling' if apply_labels else 'analysis'}...")
+    print(f"\n🚀 Starting {'classification and labeling' if apply_labels else 'planning'}...")
     print("-" * 60)
     
-    for i, issue in enumerate(tickets, 1):
-        key = issue["key"]
-        fields = issue["fields"]
-        summary = fields.get("summary", "")
-        description = fields.get("description", "")
-        current_labels = [label for label in fields.get("labels", [])]
-        
-        print(f"\n[{i}/{len(tickets)}] 🎫 Processing: {key}")
-        print(f"📝 Title: {summary}")
-        
-        if current_labels:
-            print(f"🏷️ Current labels: {current_labels}")
-        
-        try:
-            # Classify ticket
-            suggested_labels = classifier.classify(summary, description)
+    plan = None if apply_labels else PlanWriter(plan_file, append=resume)
+    
+    try:
+        for i, ticket in enumerate(tickets, 1):
+            key = ticket.key
+            current_labels = ticket.labels
+            
+            if budget and not budget.can_start_next():
+                left_over = tickets[i - 1:]
+                print(f"\n⏳ Time budget reached ({budget.remaining():.0f}s left, "
+                      f"next ticket estimated at {budget.estimate():.1f}s) - stopping cleanly")
+                break
+            if budget and i % 25 == 0:
+                print(f"\n⏳ {budget.remaining():.0f}s left, ~{budget.expected_capacity()} of "
+                      f"{total - i + 1} remaining tickets expected to fit")
+            ticket_started = time.perf_counter()
+            processed = i
+            
+            with tracer.span("ticket", key=key):
+                print(f"\n[{f'{i}/{total}' if total else i}] 🎫 Processing: {key}")
+                print(f"📝 Title: {ticket.summary}")
             
-            if suggested_labels:
-                print(f"🤖 Suggested labels: {suggested_labels}")
-                classified += 1
+                if current_labels:
+                    print(f"🏷️ Current labels: {list(current_labels)}")
+            
+                try:
+                    # Classify ticket
+                    suggested_labels = classifier.classify(ticket.summary, ticket.description)
                 
-                if apply_labels:
-                    # Filter out existing labels
-                    new_labels = [label for label in suggested_labels if label not in current_labels]
+                    if suggested_labels:
+                        print(f"🤖 Suggested labels: {suggested_labels}")
+                        classified += 1
+                        for label in suggested_labels:
+                            label_counts[label] = label_counts.get(label, 0) + 1
+                    
+                        # Filter out existing labels
+                        new_labels = [label for label in suggested_labels if label not in current_labels]
                     
-                    if new_labels:
-                        jira.assign_labels(key, new_labels)
-                        labels_applied += len(new_labels)
-                        print(f"✅ Labels applied: {new_labels}")
+                        if not new_labels:
+                            journal.record(key, UNCHANGED, suggested_labels)
+                            print("ℹ️ Labels already existed, no changes applied")
+                        elif apply_labels:
+                            # Journal the decision first so a crash mid-write is replayed on resume
+                            journal.record(key, CLASSIFIED, new_labels)
+                            write_labels(jira, journal, key, new_labels)
+                            labels_applied += len(new_labels)
+                            print(f"✅ Labels applied: {new_labels}")
+                        else:
+                            plan.write(key, new_labels)
+                            journal.record(key, PLANNED, new_labels)
+                            labels_planned += len(new_labels)
+                            print(f"📝 Labels planned: {new_labels}")
                     else:
-                        print("ℹ️ Labels already existed, no changes applied")
-                else:
-                    print("🔍 Analysis mode - labels not applied")
-            else:
-                print("⚠️ Could not determine labels for this ticket")
-                errors += 1
-                
-        except Exception as e:
-            print(f"❌ Error processing ticket {key}: {e}")
-            errors += 1
-            continue
+                        journal.record(key, FAILED)
+                        print("⚠️ Could not determine labels for this ticket")
+                        errors += 1
+                    
+                except Exception as e:
+                    print(f"❌ Error processing ticket {key}: {e}")
+                    errors += 1
+            
+            if budget:
+                budget.observe(time.perf_counter() - ticket_started)
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Interrupted - run `python main.py {'' if apply_labels else 'plan '}--resume` "
+              f"to continue where it stopped")
+        raise
+    finally:
+        journal.close()
+        if plan:
+            plan.close()
+        if trace_file:
+            tracer.close()
+            print(f"🧭 Trace written to {trace_file} (open in https://ui.perfetto.dev)")
+    
+    # With a budget the whole set was retrieved up front, even if none of it fit in the window
+    retrieved = total if total is not None else processed
+    if not retrieved:
+        print("📭 No tickets found to process")
+        return
+    
+    stats = {
+        "tickets": processed,
+        "classified": classified,
+        "errors": errors,
+        "labels_applied": labels_applied,
+        "labels_planned": labels_planned,
+        "elapsed_seconds": time.perf_counter() - started,
+        "label_counts": label_counts,
+        "left_over": len(left_over),
+        "tiers": classifier.tier_stats
+    }
+    write_summary(summary_file, stats)
     
-    # Final summary
+    print_summary(stats, command)
+    print(f"💾 Run summary saved to {summary_file}")
+    if plan:
+        print(f"📝 Label plan saved to {plan_file} - run `python main.py apply --plan-file {plan_file}`")
+    
+    if left_over:
+        unlabeled = sum(1 for ticket in left_over if not ticket.labels)
+        still_open = sum(1 for ticket in left_over if ticket.status != "done")
+        print(f"\n⏳ Left for the next window: {len(left_over)} tickets "
+              f"({unlabeled} unlabeled, {still_open} open)")
+        print("   Run again with --resume to continue from here")
+
+def write_labels(jira, journal, key, labels):
+    """Write labels to JIRA and journal the outcome
+
+    Permanent rejections (e.g. 400/403/404) are journaled as WRITE_FAILED so they are
+    not replayed forever; crashes and connection errors leave the write pending.
+    """
+    try:
+        jira.assign_labels(key, labels)
+    except Exception as e:
+        if is_permanent_error(e):
+            journal.record(key, WRITE_FAILED, labels)
+        raise
+    journal.record(key, APPLIED, labels)
+
+def print_summary(stats, command="run"):
     print("\n" + "=" * 60)
     print("📊 FINAL SUMMARY")
     print("=" * 60)
-    print(f"🎟️ Total tickets processed: {len(tickets)}")
-    print(f"✅ Successfully classified: {classified}")
-    print(f"❌ Classification errors: {errors}")
+    if "shards" in stats:
+        print(f"🧩 Shards merged: {stats['shards']}")
+    print(f"🎟️ Total tickets processed: {stats['tickets']}")
+    print(f"✅ Successfully classified: {stats['classified']}")
+    print(f"❌ Classification errors: {stats['errors']}")
+    print(f"⏱️ Elapsed time: {stats['elapsed_seconds']:.1f}s")
+    if stats.get("left_over"):
+        print(f"⏳ Left for the next window: {stats['left_over']}")
+    
+    for label, count in sorted(stats["label_counts"].items()):
+        print(f"   • {label}: {count}")
+    
+    if stats.get("tiers"):
+        print("🪜 Model tiers:")
+        for tier, tier_stats in stats["tiers"].items():
+            hit_rate = tier_stats["accepted"] / tier_stats["tickets"] * 100
+            avg_latency = tier_stats["seconds"] / tier_stats["tickets"]
+            print(f"   • {tier}: {tier_stats['tickets']} tickets, {hit_rate:.1f}% answered, "
+                  f"{avg_latency:.2f}s avg, {tier_stats['seconds']:.1f}s total")
     
-    if apply_labels:
-        print(f"🏷️ Total labels applied: {labels_applied}")
+    if command == "run":
+        print(f"🏷️ Total labels applied: {stats['labels_applied']}")
         print(f"\n🎉 Automatic classification completed!")
     else:
-        print(f"\n🔍 Analysis completed!")
+        print(f"📝 Total labels planned: {stats['labels_planned']}")
+        print(f"\n🔍 Planning completed!")
     
-    print(f"📈 Success rate: {(classified / len(tickets) * 100):.1f}%")
+    if stats["tickets"]:
+        print(f"📈 Success rate: {(stats['classified'] / stats['tickets'] * 100):.1f}%")
+
+def apply(plan_file=PLAN_FILE, concurrency=WRITE_CONCURRENCY, resume=False):
+    """Push the label diffs of a plan file to JIRA"""
+    print("🤖 JIRA AI Classifier - Applying label plan")
+    print("=" * 60)
+    
+    try:
+        env = load_env()
+    except Exception as e:
+        print(f"❌ Error loading configuration: {e}")
+        sys.exit(1)
+    
+    if not os.path.exists(plan_file):
+        print(f"❌ Plan file not found: {plan_file}")
+        sys.exit(1)
+    
+    jira = JiraClient(
+        env["JIRA_SERVER"], 
+        env["JIRA_EMAIL"], 
+        env["JIRA_API_TOKEN"],
+        env.get("JIRA_PROJECT_KEY")
+    )
+    
+    # One apply journal per plan file, so applying shard plans one after another never mixes them
+    journal_file = f"{os.path.splitext(plan_file)[0]}.apply_journal.jsonl"
+    journal = RunJournal(journal_file, resume=resume)
+    entries = read_plan(plan_file)
+    if resume:
+        print(f"♻️ Resuming from {journal_file}: {len(journal.finished)} tickets already updated")
+        entries = ((key, labels) for key, labels in entries if key not in journal.finished)
+    
+    print(f"📝 Applying label changes from {plan_file} with {concurrency} concurrent writers")
+    print("-" * 60)
+    
+    applied = 0
+    errors = 0
+    started = time.perf_counter()
+    
+    try:
+        for key, labels, error in apply_plan(jira, entries, concurrency):
+            if error:
+                print(f"❌ {key}: {error}")
+                errors += 1
+            else:
+                journal.record(key, APPLIED, labels)
+                applied += 1
+                print(f"✅ {key}: {labels}")
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Interrupted - run `python main.py apply --plan-file {plan_file} --resume` "
+              f"to continue where it stopped")
+        raise
+    finally:
+        journal.close()
+    
+    print("\n" + "=" * 60)
+    print(f"🏷️ Tickets updated: {applied}")
+    print(f"❌ Write errors: {errors}")
+    print(f"⏱️ Elapsed time: {time.perf_counter() - started:.1f}s")
+
+def merge(paths):
+    """Combine per-shard run summaries into one run summary"""
+    paths = paths or find_summaries()
+    if not paths:
+        print("📭 No shard summaries found (run_summary.shard-*.json)")
+        sys.exit(1)
+    
+    print(f"🧩 Merging {len(paths)} shard summaries: {paths}")
+    stats = merge_summaries(paths)
+    write_summary(SUMMARY_FILE, stats)
+    print_summary(stats)
+    print(f"💾 Merged summary saved to {SUMMARY_FILE}")
+
+def get_option(name, default=None):
+    """Value of `--name value` or `--name=value` on the command line"""
+    for i, arg in enumerate(sys.argv):
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+        if arg == name and i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith("--"):
+            return sys.argv[i + 1]
+    return default
 
 def show_help():
     print("🤖 JIRA AI Classifier")
-    print("Usage: python main.py [options]")
+    print("Usage: python main.py [plan|apply] [options]")
+    print("\nCommands:")
+    print("  (none)          Classify tickets and write labels to JIRA as they are decided")
+    print("  plan            Classify tickets and stream label changes to a plan file")
+    print("  apply           Write the label changes of a plan file to JIRA")
     print("\nOptions:")
-    print("  --help     Show this help message")
-    print("  --version  Show version info")
+    print("  --help          Show this help message")
+    print("  --resume        Continue an interrupted run, plan or apply from its journal")
+    print(f"  --plan-file F   Plan file written by plan and read by apply (default: {PLAN_FILE})")
+    print(f"  --write-concurrency N   Parallel JIRA writers for apply (default: {WRITE_CONCURRENCY})")
+    print(f"  --trace [FILE]  Record per-ticket spans as Chrome trace JSON (default: {TRACE_FILE})")
+    print("  --shard i/N     Only process shard i of N (0 <= i < N); run one process per shard")
+    print("  --shard-by key|project")
+    print("                  Partition by issue key hash (default) or by project")
+    print("  --merge [FILES] Combine shard summaries (default: run_summary.shard-*.json)")
+    print("  --cascade MODEL Answer with a small model first (e.g. gemma3:1b) and escalate")
+    print("                  low-confidence answers to gemma3:latest")
+    print("  --cascade-samples N     Small-model samples used to measure agreement (default: 3)")
+    print("  --cascade-threshold F   Fraction of samples that must agree (default: 0.66)")
+    print("  --time-budget T Stop cleanly before T elapses (e.g. 30m, 1h, 1800), processing")
+    print("                  unlabeled, then open, then newest tickets first")
+    print("  --version       Show version info")
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
@@ -145,4 +436,64 @@ if __name__ == "__main__":
             print("JIRA AI Classifier v1.0.0")
             sys.exit(0)
     
-    main()
+    trace_file = None
+    if any(arg == "--trace" or arg.startswith("--trace=") for arg in sys.argv):
+        trace_file = get_option("--trace", TRACE_FILE)
+    
+    if "--merge" in sys.argv:
+        files = sys.argv[sys.argv.index("--merge") + 1:]
+        merge([path for path in files if not path.startswith("--")])
+        sys.exit(0)
+    
+    shard = None
+    shard_by = get_option("--shard-by", SHARD_BY_KEY)
+    if get_option("--shard"):
+        try:
+            shard = parse_shard(get_option("--shard"))
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    if shard_by not in (SHARD_BY_KEY, SHARD_BY_PROJECT):
+        print(f"❌ Invalid --shard-by '{shard_by}', expected key or project")
+        sys.exit(1)
+    
+    time_budget = None
+    if get_option("--time-budget") is not None:
+        try:
+            time_budget = parse_duration(get_option("--time-budget"))
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    
+    cascade = None
+    if get_option("--cascade"):
+        try:
+            cascade = {
+                "cascade_model": get_option("--cascade"),
+                "cascade_samples": int(get_option("--cascade-samples", "3")),
+                "cascade_threshold": float(get_option("--cascade-threshold", "0.66"))
+            }
+        except ValueError as e:
+            print(f"❌ Invalid cascade option: {e}")
+            sys.exit(1)
+        if cascade["cascade_samples"] < 1:
+            print("❌ Invalid --cascade-samples, expected at least 1")
+            sys.exit(1)
+        if not 0 < cascade["cascade_threshold"] <= 1:
+            print("❌ Invalid --cascade-threshold, expected a fraction in (0, 1]")
+            sys.exit(1)
+    
+    command = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ("plan", "apply") else "run"
+    plan_file = get_option("--plan-file", PLAN_FILE)
+    
+    if command == "apply":
+        try:
+            concurrency = int(get_option("--write-concurrency", str(WRITE_CONCURRENCY)))
+        except ValueError:
+            print("❌ Invalid --write-concurrency, expected a number")
+            sys.exit(1)
+        apply(plan_file, concurrency, resume="--resume" in sys.argv)
+        sys.exit(0)
+    
+    main(command=command, plan_file=plan_file, resume="--resume" in sys.argv, trace_file=trace_file,
+         shard=shard, shard_by=shard_by, time_budget=time_budget, cascade=cascade)
@@ -0,0 +1,87 @@
+import json
+import os
+
+# Per-ticket outcomes written to the journal
+CLASSIFIED = "classified"  # Labels decided, JIRA write still pending
+APPLIED = "applied"        # New labels written to JIRA
+UNCHANGED = "unchanged"    # Suggested labels already present, nothing to write
+FAILED = "failed"          # Could not classify; retried on resume
+PLANNED = "planned"        # Label diff written to the plan file, applied later
+WRITE_FAILED = "write_failed"  # JIRA rejected the write for good; never replayed as pending
+
+FINISHED_STATUSES = (APPLIED, UNCHANGED, PLANNED)
+
+
+class PendingWritesError(Exception):
+    """Raised when starting a fresh run would discard unconfirmed label writes"""
+
+
+class RunJournal:
+    """Append-only JSONL log of per-ticket outcomes, used to resume interrupted runs"""
+
+    def __init__(self, path="run_journal.jsonl", resume=False, sync_every=25):
+        self.path = path
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.finished = set()
+        self.pending_writes = {}
+
+        # Always read the previous journal so unconfirmed writes are never silently discarded
+        self._load()
+        if self.pending_writes and not resume:
+            raise PendingWritesError(
+                f"{path} has {len(self.pending_writes)} label writes from an interrupted run "
+                f"that were never confirmed; rerun with --resume to replay them"
+            )
+        if not resume:
+            self.finished = set()
+
+        # A fresh run starts a new journal; a resumed one keeps appending
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+        if resume and self.file.tell() > 0:
+            # Terminate a line cut short by a crash so new entries stay parseable
+            self.file.write("\n")
+
+    def _load(self):
+        """Rebuild the state of a previous run; the last entry for a key wins"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written last line from a crash
+                    continue
+
+                key = entry["key"]
+                status = entry["status"]
+                self.pending_writes.pop(key, None)
+                self.finished.discard(key)
+
+                if status in FINISHED_STATUSES:
+                    self.finished.add(key)
+                elif status == CLASSIFIED:
+                    self.pending_writes[key] = entry.get("labels", [])
+
+    def is_done(self, key):
+        """True if the ticket needs no more work (finished or write pending replay)"""
+        return key in self.finished or key in self.pending_writes
+
+    def record(self, key, status, labels=()):
+        self.file.write(json.dumps({"key": key, "status": status, "labels": list(labels)}) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """Flush buffered entries to disk; called in batches to keep fsync cost low"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
@@ -0,0 +1,63 @@
+import re
+import time
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Parse durations such as `1800`, `90s`, `30m` or `1h` into seconds"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*", value or "")
+    if not match:
+        raise ValueError(f"Invalid duration '{value}', expected e.g. 30m, 1h or 1800")
+
+    seconds = float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+    if seconds <= 0:
+        raise ValueError(f"Invalid duration '{value}', must be greater than zero")
+    return seconds
+
+
+def priority_key(ticket):
+    """Unlabeled tickets first, then open ones, then the most recently created"""
+    return (bool(ticket.labels), ticket.status == "done", -ticket.created)
+
+
+def prioritize(tickets):
+    return sorted(tickets, key=priority_key)
+
+
+class TimeBudget:
+    """Wall-clock deadline with a per-ticket latency estimate learned from observed tickets"""
+
+    def __init__(self, seconds, alpha=0.2):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.alpha = alpha
+        self.mean = None
+        self.deviation = 0.0
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def observe(self, duration):
+        """Update the moving average and deviation of ticket latency (as TCP does for RTT)"""
+        if self.mean is None:
+            self.mean = duration
+            self.deviation = duration / 2
+        else:
+            self.deviation += self.alpha * (abs(duration - self.mean) - self.deviation)
+            self.mean += self.alpha * (duration - self.mean)
+
+    def estimate(self):
+        """Pessimistic latency of the next ticket, so slow outliers don't overrun the deadline"""
+        if self.mean is None:
+            return 0.0
+        return self.mean + 4 * self.deviation
+
+    def can_start_next(self):
+        return self.remaining() > self.estimate()
+
+    def expected_capacity(self):
+        """Approximate number of tickets that still fit in the remaining time"""
+        if not self.mean:
+            return None
+        return max(0, int(self.remaining() / self.mean))
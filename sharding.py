@@ -0,0 +1,86 @@
+import glob
+import json
+import os
+import zlib
+
+SHARD_BY_KEY = "key"
+SHARD_BY_PROJECT = "project"
+
+
+def parse_shard(spec):
+    """Parse an `i/N` shard spec (0 <= i < N) into (index, count)"""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected i/N (e.g. 0/4)")
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{spec}', index must be between 0 and {count - 1}")
+    return index, count
+
+
+def shard_of(value, count):
+    """Stable shard number for a string; crc32 is identical on every node and run"""
+    return zlib.crc32(value.encode("utf-8")) % count
+
+
+def project_of(issue_key):
+    return issue_key.rsplit("-", 1)[0]
+
+
+def in_shard(issue_key, index, count, by=SHARD_BY_KEY):
+    value = project_of(issue_key) if by == SHARD_BY_PROJECT else issue_key
+    return shard_of(value, count) == index
+
+
+def shard_suffix(index, count):
+    return f".shard-{index}-of-{count}"
+
+
+def with_suffix(path, suffix):
+    """Insert a suffix before the file extension, e.g. plan.txt -> plan.shard-0-of-2.txt"""
+    root, ext = os.path.splitext(path)
+    return f"{root}{suffix}{ext}"
+
+
+def write_summary(path, stats):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+
+
+def merge_summaries(paths):
+    """Combine per-shard run summaries into a single summary"""
+    merged = {
+        "shards": 0,
+        "tickets": 0,
+        "classified": 0,
+        "errors": 0,
+        "labels_applied": 0,
+        "labels_planned": 0,
+        "left_over": 0,
+        "elapsed_seconds": 0.0,
+        "label_counts": {},
+        "tiers": {}
+    }
+
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            stats = json.load(f)
+
+        merged["shards"] += 1
+        for field in ("tickets", "classified", "errors", "labels_applied", "labels_planned", "left_over"):
+            merged[field] += stats.get(field, 0)
+        # Shards run in parallel, so wall time is the slowest shard
+        merged["elapsed_seconds"] = max(merged["elapsed_seconds"], stats.get("elapsed_seconds", 0.0))
+        for label, count in stats.get("label_counts", {}).items():
+            merged["label_counts"][label] = merged["label_counts"].get(label, 0) + count
+        for tier, tier_stats in stats.get("tiers", {}).items():
+            merged_tier = merged["tiers"].setdefault(tier, {"tickets": 0, "accepted": 0, "seconds": 0.0})
+            for field in merged_tier:
+                merged_tier[field] += tier_stats.get(field, 0)
+
+    return merged
+
+
+def find_summaries(pattern="run_summary.shard-*.json"):
+    return sorted(glob.glob(pattern))
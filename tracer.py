@@ -0,0 +1,75 @@
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    """Streams timed spans to a Chrome/Perfetto trace-event JSON file
+
+    Events are written as soon as each span ends, so memory use does not grow
+    with the number of tickets. Open the file in chrome://tracing or
+    https://ui.perfetto.dev once the tracer is closed.
+    """
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.first_event = True
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+
+    def _now_us(self):
+        return (time.perf_counter() - self.origin) * 1_000_000
+
+    @contextmanager
+    def span(self, name, **args):
+        """Time the enclosed block; the yielded dict can be filled with extra span args"""
+        start = self._now_us()
+        try:
+            yield args
+        finally:
+            self._write({
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": self._now_us() - start,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": args
+            })
+
+    def _write(self, event):
+        line = json.dumps(event)
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line if self.first_event else ",\n" + line)
+                self.first_event = False
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.write("\n]}\n")
+                self.file.close()
+
+
+class NullTracer:
+    """Drop-in tracer used when tracing is disabled; every call is a no-op"""
+    enabled = False
+
+    def __init__(self):
+        # Shared throwaway args dict so callers can write span args unconditionally
+        self._span = nullcontext({})
+
+    def span(self, name, **args):
+        return self._span
+
+    def close(self):
+        pass
+
+
+NULL_TRACER = NullTracer()